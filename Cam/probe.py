@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import time
+from urllib.parse import urlparse
+
+import cv2
+import yaml
+
+
+# ---------- Диагностика ----------
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(values, digits=2):
+    if not values:
+        return None
+    return {
+        "mean": round(statistics.fmean(values), digits),
+        "std": round(statistics.pstdev(values), digits),
+        "p50": round(percentile(values, 0.5), digits),
+        "p95": round(percentile(values, 0.95), digits),
+        "max": round(max(values), digits),
+    }
+
+
+def fourcc_to_str(value):
+    code = int(value)
+    text = "".join(chr((code >> 8 * i) & 0xFF) for i in range(4))
+    return text if text.strip("\x00").isprintable() and code else None
+
+
+def probe_keyframes(url, frames=300):
+    """Интервал между ключевыми кадрами через ffprobe: OpenCV его не отдаёт.
+    Если ffprobe не установлен, возвращает None."""
+    if not isinstance(url, str) or shutil.which("ffprobe") is None:
+        return None
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0",
+           "-show_entries", "frame=key_frame:stream=codec_name",
+           "-read_intervals", f"%+#{frames}", "-of", "json"]
+    if url.startswith("rtsp://"):
+        cmd += ["-rtsp_transport", "tcp"]
+    try:
+        out = subprocess.run(cmd + [url], capture_output=True, text=True, timeout=60, check=True).stdout
+        data = json.loads(out)
+    except (subprocess.SubprocessError, json.JSONDecodeError) as e:
+        print(f"[PROBE ERROR] ffprobe: {e}")
+        return None
+
+    keys = [i for i, f in enumerate(data.get("frames", [])) if f.get("key_frame") == 1]
+    gaps = [b - a for a, b in zip(keys, keys[1:])]
+    streams = data.get("streams", [])
+    return {
+        "codec": streams[0].get("codec_name") if streams else None,
+        "keyframe_interval_frames": summarize(gaps, 1),
+    }
+
+
+def measure_reconnect(url, timeout=30):
+    """Время от открытия нового соединения до первого прочитанного кадра."""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        cap = cv2.VideoCapture(url)
+        if cap.isOpened():
+            ret, _ = cap.read()
+            if ret:
+                cap.release()
+                return round((time.perf_counter() - started) * 1000, 1)
+        cap.release()
+        time.sleep(0.2)
+    return None
+
+
+def probe_stream(name, url, duration=30.0, reconnect=True):
+    print(f"[PROBE] {name}: подключение...")
+    connect_started = time.perf_counter()
+    cap = cv2.VideoCapture(url)
+    if not cap.isOpened():
+        return {"camera": name, "error": "не удалось подключиться"}
+    connect_ms = (time.perf_counter() - connect_started) * 1000
+
+    report = {
+        "camera": name,
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "fourcc": fourcc_to_str(cap.get(cv2.CAP_PROP_FOURCC)),
+        "nominal_fps": round(cap.get(cv2.CAP_PROP_FPS), 2),
+        "connect_ms": round(connect_ms, 1),
+    }
+
+    intervals, read_ms, pts_lag_ms = [], [], []
+    frames, failures = 0, 0
+    first_wall = first_pts = prev_wall = None
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+
+    while time.perf_counter() - started < duration:
+        read_started = time.perf_counter()
+        ret, _ = cap.read()
+        now = time.perf_counter()
+        if not ret:
+            failures += 1
+            if not str(url).startswith("rtsp://") and failures > 3:
+                # Локальный файл закончился
+                break
+            continue
+
+        frames += 1
+        read_ms.append((now - read_started) * 1000)
+        if prev_wall is not None:
+            intervals.append((now - prev_wall) * 1000)
+        prev_wall = now
+
+        # Насколько чтение отстаёт от временных меток потока относительно первого кадра.
+        # Растущее значение значит, что декодер не успевает за камерой и копится задержка
+        pts = cap.get(cv2.CAP_PROP_POS_MSEC)
+        if first_wall is None:
+            first_wall, first_pts = now, pts
+        elif pts > 0:
+            pts_lag_ms.append((now - first_wall) * 1000 - (pts - first_pts))
+
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    cap.release()
+
+    report.update({
+        "frames": frames,
+        "read_failures": failures,
+        "duration_s": round(elapsed, 2),
+        "decode_fps": round(frames / elapsed, 2) if elapsed > 0 else 0,
+        "frame_interval_ms": summarize(intervals),
+        "read_ms": summarize(read_ms),
+        "pts_lag_ms": summarize(pts_lag_ms),
+        "cpu_ms_per_frame": round(cpu * 1000 / frames, 2) if frames else None,
+    })
+
+    keyframes = probe_keyframes(url)
+    if keyframes:
+        report.update(keyframes)
+
+    if reconnect:
+        # Соединение уже закрыто выше — это и есть принудительный обрыв
+        report["reconnect_ms"] = measure_reconnect(url)
+
+    return report
+
+
+def camera_name(url):
+    # Для RTSP имя берём из адреса хоста, чтобы логин и пароль не попали в имя файла отчёта
+    if not isinstance(url, str):
+        return f"device{url}"
+    return urlparse(url).hostname or os.path.splitext(os.path.basename(url))[0] or "camera"
+
+
+def load_cameras(args):
+    cameras = []
+    for item in args.cameras:
+        name, sep, url = item.partition("=")
+        cameras.append((name, url) if sep and "://" not in name else (camera_name(item), item))
+    for path in args.config:
+        with open(path, "r", encoding="utf-8") as f:
+            url = yaml.safe_load(f).get("camera_url")
+        if url:
+            cameras.append((os.path.basename(os.path.dirname(os.path.abspath(path))), url))
+        elif url == 0:
+            cameras.append((camera_name(url), url))
+    return cameras
+
+
+# ---------- Основной запуск ----------
+def main():
+    parser = argparse.ArgumentParser(description="Диагностика видеопотоков камер (просмотр — translation.py)")
+    parser.add_argument("cameras", nargs="*",
+                        help="URL или путь к файлу, можно с именем: name=rtsp://...")
+    parser.add_argument("--config", action="append", default=[],
+                        help="взять camera_url из config.yaml (можно несколько раз)")
+    parser.add_argument("--duration", type=float, default=30, help="длительность замера, сек")
+    parser.add_argument("--no-reconnect", action="store_true", help="не замерять переподключение")
+    parser.add_argument("--output", default="probe_reports", help="каталог для JSON-отчётов")
+    args = parser.parse_args()
+
+    cameras = load_cameras(args)
+    if not cameras:
+        parser.error("укажите URL/файл камеры или --config")
+
+    os.makedirs(args.output, exist_ok=True)
+    for name, url in cameras:
+        report = probe_stream(name, url, args.duration, not args.no_reconnect)
+        path = os.path.join(args.output, f"{name}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"[PROBE] Отчёт сохранён в {path}")
+
+
+if __name__ == "__main__":
+    main()
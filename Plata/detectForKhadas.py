@@ -5,10 +5,15 @@ from datetime import datetime
 import psutil
 from ultralytics import YOLO
 import cv2
+import numpy as np
+import torch
 import yaml
 import csv
 import os
+import random
+import sys
 import traceback
+import tracemalloc
 
 
 # ---------- Конфигурация ----------
@@ -50,7 +55,7 @@ def log_final_event(pid, info, filename="csv/people_log.csv"):
 
 
 # ---------- Детекция ----------
-def get_person_detections(result, model, confidence):
+def get_person_detections(result, model, confidence, letterbox=None):
     people = []
     try:
         for box in result.boxes:
@@ -59,7 +64,10 @@ def get_person_detections(result, model, confidence):
             track_id = int(box.id[0]) if hasattr(box, "id") and box.id is not None else None
 
             if model.names[cls] == "person" and conf > confidence and track_id is not None:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
+                xyxy = box.xyxy[0]
+                if letterbox is not None:
+                    xyxy = to_source_coords(xyxy.tolist(), letterbox)
+                x1, y1, x2, y2 = map(int, xyxy)
                 center = ((x1 + x2)//2, (y1 + y2)//2)
                 people.append({
                     "track_id": track_id,
@@ -88,6 +96,83 @@ def get_cpu_temperature():
         print(f"[TEMP ERROR] Не удалось получить температуру: {e}")
         return None
 
+# ---------- Контроль ресурсов ----------
+def sample_resources(process, watched):
+    sample = {
+        "rss_mb": process.memory_info().rss / (1024 * 1024),
+        "threads": process.num_threads(),
+    }
+    try:
+        sample["fds"] = process.num_fds()
+    except AttributeError:
+        # num_fds есть только на Unix
+        sample["fds"] = process.num_handles()
+    sample["tracked_people"] = len(watched["tracked_people"])
+    sample["queue"] = watched["frame_queue"].qsize()
+    return sample
+
+
+def resource_watchdog(watched, stop_event, restart_state, config):
+    """Раз в interval секунд снимает RSS, число дескрипторов и потоков,
+    размеры внутренних структур и сверяет их с лимитами из конфига.
+
+    Один замер — несколько системных вызовов, так что при интервале
+    в десятки секунд нагрузка на CPU практически нулевая. tracemalloc
+    заметно замедляет аллокации, поэтому включается отдельно.
+    """
+    interval = config.get("watchdog_interval", 60)
+    budgets = {
+        "rss_mb": config.get("max_rss_mb"),
+        "fds": config.get("max_open_files"),
+        "threads": config.get("max_threads"),
+        "tracked_people": config.get("max_tracked_people"),
+    }
+    action = config.get("watchdog_action", "warn")
+    tracemalloc_top = config.get("tracemalloc_top", 0)
+
+    process = psutil.Process()
+    if tracemalloc_top:
+        tracemalloc.start()
+
+    while not stop_event.wait(interval):
+        try:
+            sample = sample_resources(process, watched)
+            print(f"[RESOURCES] RSS: {sample['rss_mb']:.1f} MB | FD: {sample['fds']} | "
+                  f"потоков: {sample['threads']} | треков: {sample['tracked_people']} | "
+                  f"очередь: {sample['queue']}")
+
+            if tracemalloc_top:
+                snapshot = tracemalloc.take_snapshot()
+                for stat in snapshot.statistics("lineno")[:tracemalloc_top]:
+                    print(f"[TRACEMALLOC] {stat}")
+
+            exceeded = [f"{key}={sample[key]:.0f} > {limit}"
+                        for key, limit in budgets.items()
+                        if limit is not None and sample[key] > limit]
+            if not exceeded:
+                continue
+
+            print(f"[RESOURCES WARNING] Превышены лимиты: {', '.join(exceeded)}")
+            if action == "restart":
+                print("[RESOURCES] Контролируемый перезапуск процесса...")
+                restart_state["restart"] = True
+                stop_event.set()
+                break
+        except Exception as e:
+            print(f"[WATCHDOG ERROR] {e}")
+            traceback.print_exc()
+
+
+def restart_process(tracked_people, csv_file):
+    # Перед перезапуском дописываем всех, кто сейчас в кадре, иначе они потеряются
+    for pid, info in tracked_people.items():
+        info["total_duration"] = (info["last_seen"] - info["first_arrival"]).total_seconds()
+        log_final_event(pid, info, csv_file)
+    print("[RESTART] Перезапуск...")
+    sys.stdout.flush()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+
 # ---------- Логика слежения ----------
 def update_tracked_people(people, tracked_people, csv_file, lost_timeout=3):
     now = datetime.now()
@@ -136,10 +221,18 @@ def update_tracked_people(people, tracked_people, csv_file, lost_timeout=3):
         traceback.print_exc()
 
 
+def bridge_gap(tracked_people, gap):
+    """Сдвигает таймеры на время простоя камеры, которое насчитал захват.
+    Без этого после переподключения все ушли бы по
+    lost_timeout и тут же пришли заново как новые люди."""
+    for info in tracked_people.values():
+        info["last_seen_time"] += gap
+
+
 # ---------- Обработка кадра ----------
-def process_frame(result, model, confidence, tracked_people, csv_file):
+def process_frame(result, model, confidence, tracked_people, csv_file, letterbox=None):
     try:
-        people = get_person_detections(result, model, confidence)
+        people = get_person_detections(result, model, confidence, letterbox)
         update_tracked_people(people, tracked_people, csv_file)
         return people
     except Exception as e:
@@ -147,42 +240,251 @@ def process_frame(result, model, confidence, tracked_people, csv_file):
         return []
 
 
+# ---------- Предобработка ----------
+INTERPOLATIONS = {
+    "nearest": cv2.INTER_NEAREST,
+    "linear": cv2.INTER_LINEAR,
+    "area": cv2.INTER_AREA,
+    "cubic": cv2.INTER_CUBIC,
+}
+
+
+def letterbox_params(src_h, src_w, imgsz, stride=32):
+    ratio = min(imgsz / src_h, imgsz / src_w)
+    new_w, new_h = round(src_w * ratio), round(src_h * ratio)
+    # Вход прямоугольный и кратный stride: для 16:9 это 640x384, а не 640x640
+    in_w = int(np.ceil(new_w / stride) * stride)
+    in_h = int(np.ceil(new_h / stride) * stride)
+    return {
+        "src_shape": (src_h, src_w),
+        "ratio": ratio,
+        "size": (new_w, new_h),
+        "pad": ((in_w - new_w) // 2, (in_h - new_h) // 2),
+        "input_shape": (in_h, in_w),
+    }
+
+
+def new_preprocessor(imgsz=640, interpolation="area", pool_size=4):
+    return {
+        "imgsz": imgsz,
+        "interpolation": INTERPOLATIONS.get(interpolation, cv2.INTER_AREA),
+        "pool_size": pool_size,
+        "letterbox": None,
+        "pool": None,
+    }
+
+
+def allocate_buffers(preprocessor, src_h, src_w):
+    """Буферы выделяются один раз под размер потока и пересоздаются только
+    если камера сменила разрешение. Старый пул живёт, пока обработчик не
+    вернёт все взятые из него буферы."""
+    lb = letterbox_params(src_h, src_w, preprocessor["imgsz"])
+    in_h, in_w = lb["input_shape"]
+    new_w, new_h = lb["size"]
+    pool = {
+        "buffers": [np.empty((1, 3, in_h, in_w), np.float32) for _ in range(preprocessor["pool_size"])],
+        "free": queue.Queue(),
+    }
+    for i in range(preprocessor["pool_size"]):
+        pool["free"].put(i)
+    preprocessor["letterbox"] = lb
+    preprocessor["pool"] = pool
+    preprocessor["resized"] = np.empty((new_h, new_w, 3), np.uint8)
+    preprocessor["canvas"] = np.full((in_h, in_w, 3), 114, np.uint8)
+
+
+def preprocess_frame(preprocessor, frame):
+    """Letterbox, BGR->RGB, HWC->CHW и перевод в float32 0..1 прямо в
+    свободный буфер пула. Если все буферы заняты, возвращает None."""
+    h, w = frame.shape[:2]
+    lb = preprocessor["letterbox"]
+    if lb is None or lb["src_shape"] != (h, w):
+        allocate_buffers(preprocessor, h, w)
+        lb = preprocessor["letterbox"]
+
+    pool = preprocessor["pool"]
+    try:
+        index = pool["free"].get_nowait()
+    except queue.Empty:
+        return None
+
+    resized, canvas = preprocessor["resized"], preprocessor["canvas"]
+    new_w, new_h = lb["size"]
+    pad_x, pad_y = lb["pad"]
+    cv2.resize(frame, (new_w, new_h), dst=resized, interpolation=preprocessor["interpolation"])
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+
+    buffer = pool["buffers"][index]
+    np.multiply(canvas.transpose(2, 0, 1)[::-1], np.float32(1 / 255), out=buffer[0], dtype=np.float32)
+    return {
+        "tensor": torch.from_numpy(buffer),
+        "pool": pool,
+        "index": index,
+        "letterbox": lb,
+    }
+
+
+def release_buffer(item):
+    item["pool"]["free"].put(item["index"])
+
+
+def to_source_coords(xyxy, letterbox):
+    ratio = letterbox["ratio"]
+    pad_x, pad_y = letterbox["pad"]
+    src_h, src_w = letterbox["src_shape"]
+    x1, y1, x2, y2 = xyxy
+    return (
+        min(max((x1 - pad_x) / ratio, 0), src_w),
+        min(max((y1 - pad_y) / ratio, 0), src_h),
+        min(max((x2 - pad_x) / ratio, 0), src_w),
+        min(max((y2 - pad_y) / ratio, 0), src_h),
+    )
+
+
+# ---------- Захват ----------
+def open_capture(camera_url, timeout_ms):
+    # Таймауты FFmpeg не дают cap.read() висеть вечно на мёртвом RTSP (OpenCV >= 4.6)
+    try:
+        params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout_ms, cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout_ms]
+        return cv2.VideoCapture(camera_url, cv2.CAP_ANY, params)
+    except (AttributeError, cv2.error):
+        return cv2.VideoCapture(camera_url)
+
+
+def backoff_delay(attempt, base=0.5, max_delay=30.0):
+    """Экспоненциальная задержка с джиттером, чтобы несколько плат не
+    переподключались к NVR синхронно."""
+    # Степень ограничена: после ночи без камеры 2 ** attempt иначе переполняет float
+    return min(max_delay, base * 2 ** min(attempt, 16)) * random.uniform(0.5, 1.0)
+
+
+def new_capture_state():
+    return {
+        "generation": 0,
+        "connected": False,
+        "last_frame_time": time.monotonic(),
+        "outage_started": None,
+        "outages": 0,
+        "downtime_total": 0.0,
+        "last_downtime": 0.0,
+        "last_reconnect_ms": None,
+    }
+
+
+def mark_outage(capture_state, reason):
+    if capture_state["outage_started"] is None:
+        # Простой считаем от последнего удачного кадра, а не от момента, когда его заметили
+        capture_state["outage_started"] = capture_state["last_frame_time"]
+        capture_state["outages"] += 1
+        print(f"[OUTAGE] {reason}")
+    capture_state["connected"] = False
+
+
+def mark_frame(capture_state, reconnect_started):
+    now = time.monotonic()
+    if capture_state["outage_started"] is not None:
+        downtime = now - capture_state["outage_started"]
+        capture_state["last_downtime"] = downtime
+        capture_state["downtime_total"] += downtime
+        capture_state["last_reconnect_ms"] = (now - reconnect_started) * 1000
+        capture_state["outage_started"] = None
+        print(f"[RECONNECT] Поток восстановлен: простой {downtime:.1f} с, "
+              f"переподключение {capture_state['last_reconnect_ms']:.0f} мс, "
+              f"обрывов всего {capture_state['outages']}, простой всего {capture_state['downtime_total']:.1f} с")
+    capture_state["connected"] = True
+    capture_state["last_frame_time"] = now
+
+
 # ---------- Потоки ----------
-def frame_reader(camera_url, frame_queue, stop_event):
+def frame_reader(camera_url, frame_queue, stop_event, capture_state, generation, preprocessor, timeout_ms=5000):
     cap = None
-    while not stop_event.is_set():
+    frame = None
+    attempt = 0
+    reconnect_started = time.monotonic()
+
+    # Поток завершается сам, если супервизор посчитал его зависшим и запустил замену
+    while not stop_event.is_set() and capture_state["generation"] == generation:
         try:
             if cap is None or not cap.isOpened():
                 print("[CONNECT] Подключение к камере...")
-                cap = cv2.VideoCapture(camera_url)
+                cap = open_capture(camera_url, timeout_ms)
                 if not cap.isOpened():
-                    print("[CAMERA ERROR] Не удалось подключиться. Повтор через 5 сек.")
-                    time.sleep(5)
+                    delay = backoff_delay(attempt)
+                    attempt += 1
+                    print(f"[CAMERA ERROR] Не удалось подключиться. Повтор через {delay:.1f} сек.")
+                    stop_event.wait(delay)
                     continue
 
-            ret, frame = cap.read()
+            # Кадр нужен только до предобработки, поэтому читаем в один и тот же массив
+            ret, frame = cap.read(frame)
+            if capture_state["generation"] != generation:
+                break
             if not ret or frame is None:
-                print("[FRAME ERROR] Ошибка чтения кадра, попытка повторить...")
-                time.sleep(0.5)
+                frame = None
+                mark_outage(capture_state, "Ошибка чтения кадра, переподключение...")
+                cap.release()
+                cap = None
+                reconnect_started = time.monotonic()
+                stop_event.wait(backoff_delay(attempt))
+                attempt += 1
                 continue
 
-            if not frame_queue.full():
-                frame_queue.put(frame)
+            attempt = 0
+            mark_frame(capture_state, reconnect_started)
+            if frame_queue.full():
+                continue
+            item = preprocess_frame(preprocessor, frame)
+            if item is not None:
+                frame_queue.put(item)
 
         except Exception as e:
             print(f"[READER ERROR] {e}")
             traceback.print_exc()
-            time.sleep(5)
+            mark_outage(capture_state, "Ошибка захвата, переподключение...")
+            if cap:
+                cap.release()
+            cap = None
+            reconnect_started = time.monotonic()
+            stop_event.wait(backoff_delay(attempt))
+            attempt += 1
 
     if cap:
         cap.release()
 
 
-def frame_processor(frame_queue, model, confidence, stop_event, csv_file):
-    tracked_people = {}
+def capture_supervisor(camera_url, frame_queue, stop_event, capture_state, preprocessor, read_timeout=10.0):
+    """Запускает frame_reader и следит, чтобы кадры шли. Если cap.read()
+    завис дольше read_timeout, зависший поток бросается (он daemon и
+    выйдет сам, когда read() вернётся), а вместо него запускается новый."""
+    timeout_ms = int(read_timeout * 1000)
+
+    def start_reader():
+        generation = capture_state["generation"]
+        capture_state["last_frame_time"] = time.monotonic()
+        thread = threading.Thread(target=frame_reader,
+                                  args=(camera_url, frame_queue, stop_event, capture_state, generation,
+                                        preprocessor, timeout_ms),
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    reader = start_reader()
+    while not stop_event.wait(1.0):
+        stalled = time.monotonic() - capture_state["last_frame_time"] > read_timeout
+        if capture_state["connected"] and stalled:
+            mark_outage(capture_state, f"Нет кадров {read_timeout:.0f} с, перезапуск захвата...")
+            capture_state["generation"] += 1
+            reader = start_reader()
+        elif not reader.is_alive():
+            capture_state["generation"] += 1
+            reader = start_reader()
+
+
+def frame_processor(frame_queue, model, confidence, stop_event, csv_file, tracked_people, capture_state):
     frame_count = 0
     start_time = time.time()
     report_interval = 10  # interval FPS
+    seen_downtime = 0.0
 
     while not stop_event.is_set():
         try:
@@ -190,12 +492,22 @@ def frame_processor(frame_queue, model, confidence, stop_event, csv_file):
                 time.sleep(0.01)
                 continue
 
-            frame = frame_queue.get()
-            results = model.track(frame, persist=True)
+            item = frame_queue.get()
+            try:
+                results = model.track(item["tensor"], persist=True)
+            finally:
+                release_buffer(item)
             if not results:
                 continue
 
-            process_frame(results[0], model, confidence, tracked_people, csv_file)
+            # Сдвигаем таймеры только на простой, который зафиксировал захват: медленный
+            # инференс обрывом не считается, иначе уходы перестали бы логироваться
+            downtime = capture_state["downtime_total"]
+            if downtime > seen_downtime:
+                bridge_gap(tracked_people, downtime - seen_downtime)
+                seen_downtime = downtime
+
+            process_frame(results[0], model, confidence, tracked_people, csv_file, item["letterbox"])
 
             # Подсчёт FPS
             frame_count += 1
@@ -204,7 +516,9 @@ def frame_processor(frame_queue, model, confidence, stop_event, csv_file):
                 fps = frame_count / elapsed if elapsed > 0 else 0
                 temp = get_cpu_temperature()
                 temp_str = f" | CPU: {temp:.1f}°C" if temp is not None else ""
-                print(f"[INFO] Средний FPS за последние {report_interval} кадров: {fps:.2f}{temp_str}")
+                outage_str = (f" | обрывов: {capture_state['outages']}, простой: {capture_state['downtime_total']:.1f} с"
+                              if capture_state["outages"] else "")
+                print(f"[INFO] Средний FPS за последние {report_interval} кадров: {fps:.2f}{temp_str}{outage_str}")
                 # Сброс счётчиков для плавного усреднения
                 frame_count = 0
                 start_time = time.time()
@@ -229,16 +543,36 @@ def main():
 
         frame_queue = queue.Queue(maxsize=5)
         stop_event = threading.Event()
-
-        reader_thread = threading.Thread(target=frame_reader, args=(camera_url, frame_queue, stop_event))
-        processor_thread = threading.Thread(target=frame_processor, args=(frame_queue, model, confidence, stop_event, csv_file))
+        tracked_people = {}
+        restart_state = {"restart": False}
+        capture_state = new_capture_state()
+        preprocessor = new_preprocessor(config.get("imgsz", 640),
+                                        config.get("interpolation", "area"),
+                                        config.get("preprocess_buffers", 4))
+
+        reader_thread = threading.Thread(target=capture_supervisor,
+                                         args=(camera_url, frame_queue, stop_event, capture_state, preprocessor,
+                                               config.get("read_timeout", 10.0)))
+        processor_thread = threading.Thread(target=frame_processor,
+                                            args=(frame_queue, model, confidence, stop_event, csv_file, tracked_people,
+                                                  capture_state))
 
         reader_thread.start()
         processor_thread.start()
 
+        if config.get("watchdog", False):
+            watched = {"tracked_people": tracked_people, "frame_queue": frame_queue}
+            watchdog_thread = threading.Thread(target=resource_watchdog,
+                                               args=(watched, stop_event, restart_state, config),
+                                               daemon=True)
+            watchdog_thread.start()
+
         reader_thread.join()
         processor_thread.join()
 
+        if restart_state["restart"]:
+            restart_process(tracked_people, csv_file)
+
     except KeyboardInterrupt:
         print("\n[STOP] Принудительная остановка пользователем.")
     except Exception as e:
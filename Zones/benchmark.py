@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from main import (prepare_zones, get_person_detections, update_tracked_people,
+                  analyze_zones, render_frame)
+
+FRAME_SHAPE = (1080, 1920, 3)
+PEOPLE_COUNTS = (1, 10, 50, 200, 500)
+ZONE_COUNTS = (1, 10, 100)
+
+
+# ---------- Синтетическая сцена ----------
+class FakeBox:
+    """Повторяет ровно те поля Boxes из ultralytics, которые читает get_person_detections."""
+
+    def __init__(self, xyxy, conf, track_id):
+        self.cls = np.array([0.0])
+        self.conf = np.array([conf])
+        self.id = np.array([float(track_id)])
+        self.xyxy = np.array([xyxy])
+
+
+class FakeResult:
+    def __init__(self, boxes):
+        self.boxes = boxes
+        self.orig_img = np.zeros(FRAME_SHAPE, np.uint8)
+
+
+class FakeModel:
+    names = {0: "person"}
+
+
+def make_boxes(rng, n_people):
+    h, w = FRAME_SHAPE[:2]
+    boxes = []
+    for i in range(n_people):
+        x1, y1 = rng.integers(0, w - 100), rng.integers(0, h - 200)
+        bw, bh = rng.integers(30, 100), rng.integers(60, 200)
+        boxes.append(FakeBox([x1, y1, x1 + bw, y1 + bh], rng.uniform(0.55, 0.99), i + 1))
+    return boxes
+
+
+def make_zones(rng, n_zones):
+    h, w = FRAME_SHAPE[:2]
+    zone_list = []
+    for i in range(n_zones):
+        x, y = int(rng.integers(0, w - 200)), int(rng.integers(0, h - 200))
+        zw, zh = int(rng.integers(50, 200)), int(rng.integers(50, 200))
+        zone_list.append({
+            "name": f"Zone {i + 1}",
+            "color": [int(c) for c in rng.integers(0, 256, 3)],
+            "points": [[x, y], [x + zw, y], [x + zw, y + zh], [x, y + zh]],
+        })
+    return prepare_zones(zone_list)
+
+
+# ---------- Замеры ----------
+def measure(fn, min_time=0.2, repeat=5):
+    """Минимальное среднее время одного вызова fn() из repeat серий, мкс."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - start >= min_time / repeat:
+            break
+        number *= 2
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best * 1e6
+
+
+def bench_scene(n_people, n_zones, csv_file, seed=0):
+    rng = np.random.default_rng(seed)
+    model = FakeModel()
+    result = FakeResult(make_boxes(rng, n_people))
+    zones = make_zones(rng, n_zones)
+    people = get_person_detections(result, model, 0.5)
+
+    # Первый вызов регистрирует всех как пришедших; дальше замеряется установившийся режим
+    tracked_people = {}
+    update_tracked_people(people, tracked_people, zones, csv_file)
+    latest = {"frame": result.orig_img, "people": people, "zones": zones, "fps": 25.0}
+    render_cache = {}
+
+    return {
+        "get_person_detections": measure(lambda: get_person_detections(result, model, 0.5)),
+        "update_tracked_people": measure(lambda: update_tracked_people(people, tracked_people, zones, csv_file)),
+        "analyze_zones": measure(lambda: [analyze_zones(p, zones) for p in people]),
+        "render_frame": measure(lambda: render_frame(latest, render_cache, 960)),
+    }
+
+
+def run_suite():
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, "bench_log.csv")
+        for n_people in PEOPLE_COUNTS:
+            for n_zones in ZONE_COUNTS:
+                scene = f"people={n_people},zones={n_zones}"
+                for stage, us in bench_scene(n_people, n_zones, csv_file).items():
+                    results[f"{stage}[{scene}]"] = us
+                    print(f"{stage:<24} {scene:<22} {us:12.1f} мкс")
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, us in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = us / base if base > 0 else 1.0
+        if ratio > 1 + threshold:
+            regressions.append((name, base, us, ratio))
+    return regressions
+
+
+# ---------- Основной запуск ----------
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарк покадровой логики без модели и камеры")
+    parser.add_argument("--baseline", default="benchmark_baseline.json")
+    parser.add_argument("--save", action="store_true", help="записать результаты как новый baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="допустимое замедление относительно baseline (0.25 = +25%%)")
+    args = parser.parse_args()
+
+    results = run_suite()
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"[BENCH] Baseline сохранён в {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"[BENCH] Нет baseline {args.baseline}, запустите с --save")
+        return
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.threshold)
+    for name, base, us, ratio in regressions:
+        print(f"[REGRESSION] {name}: {base:.1f} → {us:.1f} мкс (×{ratio:.2f})")
+    if regressions:
+        sys.exit(1)
+    print(f"[BENCH] Регрессий больше {args.threshold:.0%} нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import argparse
+import glob
+import os
+import threading
+import traceback
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+ALL_ZONES = "__all__"
+# Слои зон пишутся в .npz с префиксом, чтобы имя зоны не столкнулось с метаданными (cell, grid_shape...)
+LAYER_PREFIX = "zone:"
+BUCKET_FORMAT = "%Y-%m-%d_%H"
+
+
+# ---------- Накопление ----------
+def new_heatmap(directory="heatmaps", cell=16):
+    return {
+        "dir": directory,
+        "cell": cell,
+        "frame_shape": None,
+        "grid_shape": None,
+        "buckets": {},
+        "tracks": {},
+        "lock": threading.Lock(),
+    }
+
+
+def bucket_path(heatmap, bucket):
+    return os.path.join(heatmap["dir"], f"{bucket}.npz")
+
+
+def get_bucket(heatmap, bucket):
+    grids = heatmap["buckets"].get(bucket)
+    if grids is None:
+        grids = {}
+        # После перезапуска посреди часа продолжаем уже сохранённый файл, а не затираем его
+        path = bucket_path(heatmap, bucket)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                if tuple(data["grid_shape"]) == heatmap["grid_shape"]:
+                    grids = {key[len(LAYER_PREFIX):]: data[key].copy() for key in data.files
+                             if key.startswith(LAYER_PREFIX)}
+        heatmap["buckets"][bucket] = grids
+    return grids
+
+
+def tracks_path(heatmap, bucket):
+    return os.path.join(heatmap["dir"], f"{bucket}_tracks.npz")
+
+
+def get_tracks(heatmap, bucket):
+    tracks = heatmap["tracks"].get(bucket)
+    if tracks is None:
+        tracks = []
+        path = tracks_path(heatmap, bucket)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                points = np.split(data["points"], np.cumsum(data["lengths"])[:-1])
+                tracks = list(zip(data["ids"].tolist(), points))
+        heatmap["tracks"][bucket] = tracks
+    return tracks
+
+
+def add_trajectory(heatmap, pid, trail, now=None):
+    """Сохраняет последние позиции ушедшего трека в корзину часа ухода."""
+    if len(trail) == 0:
+        return
+    bucket = (now or datetime.now()).strftime(BUCKET_FORMAT)
+    with heatmap["lock"]:
+        get_tracks(heatmap, bucket).append((pid, np.array(trail, np.int32)))
+
+
+def add_time(grids, name, shape, cy, cx, dt):
+    grid = grids.get(name)
+    if grid is None:
+        grid = grids[name] = np.zeros(shape, np.float32)
+    grid[cy, cx] += dt
+
+
+def update_heatmap(heatmap, people, tracked_people, frame_shape, dt, now=None):
+    """Добавляет dt секунд присутствия в ячейку под центром каждого человека:
+    в общий слой и в слой каждой зоны, где он сейчас находится. Работа
+    пропорциональна числу людей в кадре, от размера сетки не зависит."""
+    if not people or dt <= 0:
+        return
+    if heatmap["frame_shape"] != frame_shape:
+        h, w = frame_shape
+        cell = heatmap["cell"]
+        heatmap["frame_shape"] = frame_shape
+        heatmap["grid_shape"] = ((h + cell - 1) // cell, (w + cell - 1) // cell)
+    grid_shape = heatmap["grid_shape"]
+    gh, gw = grid_shape
+    cell = heatmap["cell"]
+    bucket = (now or datetime.now()).strftime(BUCKET_FORMAT)
+
+    with heatmap["lock"]:
+        grids = get_bucket(heatmap, bucket)
+        for p in people:
+            cx, cy = p["center"]
+            cx, cy = min(max(cx // cell, 0), gw - 1), min(max(cy // cell, 0), gh - 1)
+            add_time(grids, ALL_ZONES, grid_shape, cy, cx, dt)
+            info = tracked_people.get(p["track_id"])
+            for name in info["zones"] if info else ():
+                add_time(grids, name, grid_shape, cy, cx, dt)
+
+
+# ---------- Сохранение ----------
+def save_heatmap(heatmap, keep_current=True):
+    """Пишет все часовые корзины и траектории в сжатые .npz. Закрытые часы
+    после записи выгружаются из памяти, текущий остаётся и дописывается дальше."""
+    current = datetime.now().strftime(BUCKET_FORMAT)
+    with heatmap["lock"]:
+        grid_snapshot = {}
+        if heatmap["grid_shape"] is not None:
+            grid_snapshot = {bucket: {name: grid.copy() for name, grid in grids.items()}
+                             for bucket, grids in heatmap["buckets"].items()}
+            meta = {
+                "cell": np.array(heatmap["cell"]),
+                "frame_shape": np.array(heatmap["frame_shape"]),
+                "grid_shape": np.array(heatmap["grid_shape"]),
+            }
+        track_snapshot = {bucket: list(tracks) for bucket, tracks in heatmap["tracks"].items()}
+        for store in (heatmap["buckets"], heatmap["tracks"]):
+            for bucket in list(store):
+                if bucket != current or not keep_current:
+                    del store[bucket]
+
+    os.makedirs(heatmap["dir"], exist_ok=True)
+    for bucket, grids in grid_snapshot.items():
+        layers = {LAYER_PREFIX + name: grid for name, grid in grids.items()}
+        write_npz(bucket_path(heatmap, bucket), **meta, **layers)
+    for bucket, tracks in track_snapshot.items():
+        if not tracks:
+            continue
+        # Траектории разной длины храним одним массивом точек и длинами для разбиения
+        write_npz(tracks_path(heatmap, bucket),
+                  ids=np.array([pid for pid, _ in tracks], np.int64),
+                  lengths=np.array([len(points) for _, points in tracks], np.int64),
+                  points=np.concatenate([points for _, points in tracks]))
+
+
+def write_npz(path, **arrays):
+    tmp = path + ".tmp.npz"
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def heatmap_writer(heatmap, stop_event, interval=300):
+    while not stop_event.wait(interval):
+        try:
+            save_heatmap(heatmap)
+        except Exception as e:
+            print(f"[HEATMAP ERROR] Не удалось сохранить тепловую карту: {e}")
+            traceback.print_exc()
+
+
+# ---------- Построение ----------
+def load_range(directory, start, end, zone=ALL_ZONES):
+    total = None
+    meta = None
+    for path in sorted(glob.glob(os.path.join(directory, "*.npz"))):
+        try:
+            bucket = datetime.strptime(os.path.basename(path)[:-4], BUCKET_FORMAT)
+        except ValueError:
+            continue
+        if not start <= bucket < end:
+            continue
+        key = LAYER_PREFIX + zone
+        with np.load(path) as data:
+            if key not in data.files:
+                continue
+            if total is None:
+                total = data[key].astype(np.float64)
+                meta = {"cell": int(data["cell"]), "frame_shape": tuple(data["frame_shape"])}
+            elif data[key].shape == total.shape:
+                total += data[key]
+            else:
+                print(f"[HEATMAP] {path}: другой размер сетки, пропущен")
+    return total, meta
+
+
+def load_tracks_range(directory, start, end):
+    tracks = []
+    for path in sorted(glob.glob(os.path.join(directory, "*_tracks.npz"))):
+        try:
+            bucket = datetime.strptime(os.path.basename(path)[:-len("_tracks.npz")], BUCKET_FORMAT)
+        except ValueError:
+            continue
+        if start <= bucket < end:
+            with np.load(path) as data:
+                tracks.extend(np.split(data["points"], np.cumsum(data["lengths"])[:-1]))
+    return tracks
+
+
+def draw_tracks(image, tracks, color=(255, 255, 255)):
+    for points in tracks:
+        if len(points) > 1:
+            cv2.polylines(image, [points.reshape(-1, 1, 2)], False, color, 1, cv2.LINE_AA)
+    return image
+
+
+def render_heatmap(total, meta, background=None, alpha=0.6):
+    h, w = meta["frame_shape"]
+    norm = np.zeros(total.shape, np.uint8)
+    if total.max() > 0:
+        norm = np.clip(total / total.max() * 255, 0, 255).astype(np.uint8)
+    colored = cv2.resize(cv2.applyColorMap(norm, cv2.COLORMAP_JET), (w, h), interpolation=cv2.INTER_LINEAR)
+    if background is None:
+        return colored
+    background = cv2.resize(background, (w, h))
+    return cv2.addWeighted(background, 1 - alpha, colored, alpha, 0)
+
+
+def parse_hour(value):
+    for fmt in ("%Y-%m-%d %H", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"ожидается 'YYYY-MM-DD HH', получено {value!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Тепловая карта использования бассейна за период")
+    parser.add_argument("--from", dest="start", type=parse_hour, required=True, help="'YYYY-MM-DD HH'")
+    parser.add_argument("--to", dest="end", type=parse_hour, required=True, help="'YYYY-MM-DD HH' (не включая)")
+    parser.add_argument("--zone", default=ALL_ZONES, help="имя зоны, по умолчанию весь кадр")
+    parser.add_argument("--dir", default="heatmaps")
+    parser.add_argument("--background", help="кадр с камеры, поверх которого рисовать")
+    parser.add_argument("--tracks", action="store_true", help="нарисовать траектории ушедших за период")
+    parser.add_argument("--output", default="heatmap.png")
+    args = parser.parse_args()
+
+    total, meta = load_range(args.dir, args.start, args.end, args.zone)
+    if total is None:
+        print(f"[HEATMAP] Нет данных для '{args.zone}' за указанный период")
+        return
+
+    background = cv2.imread(args.background) if args.background else None
+    image = render_heatmap(total, meta, background)
+    if args.tracks:
+        draw_tracks(image, load_tracks_range(args.dir, args.start, args.end))
+    cv2.imwrite(args.output, image)
+    print(f"[HEATMAP] Человеко-часов: {total.sum() / 3600:.1f}. Сохранено в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,12 @@ from ultralytics import YOLO
 import cv2
 import yaml
 import numpy as np
+import torch
 import csv
 import os
+import random
+import traceback
+from heatmap import ALL_ZONES, new_heatmap, update_heatmap, add_trajectory, heatmap_writer, save_heatmap
 
 
 # ---------- Конфигурация ----------
@@ -16,6 +20,90 @@ def load_config(path="config.yaml"):
         return yaml.safe_load(f)
 
 
+def validate_config(config):
+    if not isinstance(config, dict):
+        raise ValueError("файл должен содержать словарь YAML")
+
+    confidence = config.get("confidence", 0.5)
+    if isinstance(confidence, bool) or not isinstance(confidence, (int, float)) or not 0 <= confidence <= 1:
+        raise ValueError(f"confidence должен быть числом от 0 до 1, получено {confidence!r}")
+
+    zone_list = config.get("zones", [])
+    if not isinstance(zone_list, list):
+        raise ValueError("zones должен быть списком")
+
+    names = set()
+    for i, z in enumerate(zone_list):
+        if not isinstance(z, dict) or not z.get("name"):
+            raise ValueError(f"зона #{i + 1}: не задано имя")
+        name = z["name"]
+        if name in names:
+            raise ValueError(f"зона '{name}': имя повторяется")
+        if name == ALL_ZONES:
+            raise ValueError(f"зона '{name}': имя зарезервировано для общего слоя тепловой карты")
+        names.add(name)
+
+        points = z.get("points")
+        if not isinstance(points, list) or len(points) < 3:
+            raise ValueError(f"зона '{name}': нужно минимум 3 точки")
+        for pt in points:
+            if (not isinstance(pt, (list, tuple)) or len(pt) != 2
+                    or not all(isinstance(c, (int, float)) and not isinstance(c, bool) for c in pt)):
+                raise ValueError(f"зона '{name}': некорректная точка {pt!r}")
+
+        color = z.get("color", [0, 0, 255])
+        if (not isinstance(color, (list, tuple)) or len(color) != 3
+                or not all(isinstance(c, int) and 0 <= c <= 255 for c in color)):
+            raise ValueError(f"зона '{name}': цвет должен быть [B, G, R] от 0 до 255")
+
+
+def build_settings(config):
+    """Проверяет конфигурацию и готовит всё, что можно менять без перезапуска."""
+    validate_config(config)
+    return {
+        "zones": prepare_zones(config.get("zones", [])),
+        "confidence": config.get("confidence", 0.5),
+    }
+
+
+def config_watcher(path, settings_state, stop_event, interval=2.0):
+    """Следит за файлом конфигурации и подменяет зоны и порог на лету.
+
+    Новые настройки собираются целиком в этом потоке, а в settings_state
+    кладутся одним присваиванием, поэтому обработчик кадров видит либо
+    старую, либо новую конфигурацию, но не их смесь.
+    """
+    try:
+        last_mtime = os.path.getmtime(path)
+    except OSError:
+        last_mtime = None
+
+    while not stop_event.wait(interval):
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError as e:
+            print(f"[CONFIG ERROR] Нет доступа к {path}: {e}")
+            continue
+        if mtime == last_mtime:
+            continue
+        last_mtime = mtime
+
+        try:
+            config = load_config(path)
+            settings = build_settings(config)
+        except Exception as e:
+            print(f"[CONFIG ERROR] Конфигурация {path} отклонена: {e}. Работаем со старой.")
+            continue
+
+        for key in ("camera_url", "yolo_model"):
+            if config.get(key) != settings_state.get(key):
+                print(f"[CONFIG] Изменение {key} вступит в силу только после перезапуска")
+
+        settings_state["settings"] = settings
+        print(f"[CONFIG] Конфигурация перезагружена: зон {len(settings['zones'])}, "
+              f"confidence {settings['confidence']}")
+
+
 # ---------- CSV ----------
 def init_csv(filename="csv/people_log_with_zones.csv"):
     if not os.path.exists(filename):
@@ -53,13 +141,8 @@ def point_in_zone(point, zone_points):
     return cv2.pointPolygonTest(zone_points, point, False) >= 0
 
 
-def draw_zones(frame, zones):
-    for z in zones:
-        cv2.polylines(frame, [z["points"]], True, z["color"], 2)
-
-
 # ---------- Детекция ----------
-def get_person_detections(result, model, confidence):
+def get_person_detections(result, model, confidence, letterbox=None):
     people = []
     for box in result.boxes:
         cls = int(box.cls[0])
@@ -67,7 +150,10 @@ def get_person_detections(result, model, confidence):
         track_id = int(box.id[0]) if hasattr(box, "id") and box.id is not None else None
 
         if model.names[cls] == "person" and conf > confidence and track_id is not None:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
+            xyxy = box.xyxy[0]
+            if letterbox is not None:
+                xyxy = to_source_coords(xyxy.tolist(), letterbox)
+            x1, y1, x2, y2 = map(int, xyxy)
             center = ((x1 + x2)//2, (y1 + y2)//2)
             people.append({
                 "track_id": track_id,
@@ -87,7 +173,24 @@ def analyze_zones(person, zones):
 
 
 # ---------- Логика слежения ----------
-def update_tracked_people(people, tracked_people, csv_file):
+TRAIL_SIZE = 64
+
+
+def push_trail(info, center):
+    # Кольцевой буфер фиксированного размера: память на трек не растёт со временем
+    info["trail"][info["trail_count"] % TRAIL_SIZE] = center
+    info["trail_count"] += 1
+
+
+def get_trail(info):
+    """Последние позиции трека в хронологическом порядке."""
+    count = info["trail_count"]
+    if count <= TRAIL_SIZE:
+        return info["trail"][:count]
+    return np.roll(info["trail"], -(count % TRAIL_SIZE), axis=0)
+
+
+def update_tracked_people(people, tracked_people, zones, csv_file, hold_departures=False, heatmap=None):
     current_ids = {p["track_id"] for p in people}
 
     # Новые люди
@@ -98,13 +201,22 @@ def update_tracked_people(people, tracked_people, csv_file):
             tracked_people[pid] = {
                 "start_time": datetime.now(),
                 "zones": zones_inside,
-                "last_seen": datetime.now()
+                "last_seen": datetime.now(),
+                "trail": np.empty((TRAIL_SIZE, 2), np.int32),
+                "trail_count": 0
             }
+            push_trail(tracked_people[pid], p["center"])
             print(f"[ARRIVAL] Человек {pid} вошёл в {zones_inside}")
             log_event(pid, "arrival", zones_inside, filename=csv_file)
         else:
             tracked_people[pid]["last_seen"] = datetime.now()
             tracked_people[pid]["zones"] = zones_inside
+            push_trail(tracked_people[pid], p["center"])
+
+    # Сразу после обрыва камеры трекеру нужно несколько кадров, чтобы снова
+    # подхватить людей, поэтому уходы пока не фиксируем
+    if hold_departures:
+        return
 
     # Проверяем, кто ушёл
     gone_ids = []
@@ -114,6 +226,8 @@ def update_tracked_people(people, tracked_people, csv_file):
             duration = (now - info["start_time"]).total_seconds()
             print(f"[DEPARTURE] Человек {pid} покинул все зоны. Был {duration:.2f} сек.")
             log_event(pid, "departure", info["zones"], duration, csv_file)
+            if heatmap is not None:
+                add_trajectory(heatmap, pid, get_trail(info))
             gone_ids.append(pid)
 
     for gid in gone_ids:
@@ -121,9 +235,76 @@ def update_tracked_people(people, tracked_people, csv_file):
 
 
 # ---------- Отрисовка ----------
-def draw_detections(frame, people, zones):
+LABEL_CACHE_LIMIT = 2000
+
+
+def get_zone_overlay(cache, zones, shape, scale):
+    """Слой с контурами зон в разрешении дисплея. Перерисовывается только
+    при смене набора зон (горячая перезагрузка) или размера кадра."""
+    overlay = cache.get("zones")
+    if overlay is not None and overlay["zones"] is zones and overlay["shape"] == shape:
+        return overlay
+
+    image = np.zeros(shape, np.uint8)
+    mask = np.zeros(shape[:2], np.uint8)
+    for z in zones:
+        points = np.round(z["points"] * scale).astype(np.int32)
+        cv2.polylines(image, [points], True, z["color"], 2)
+        cv2.polylines(mask, [points], True, 255, 2)
+
+    overlay = {"zones": zones, "shape": shape, "image": image, "mask": mask.astype(bool)}
+    cache["zones"] = overlay
+    return overlay
+
+
+def get_label(cache, text, color, font_scale=0.6, thickness=2):
+    labels = cache.setdefault("labels", {})
+    key = (text, color, font_scale, thickness)
+    glyph = labels.get(key)
+    if glyph is None:
+        if len(labels) >= LABEL_CACHE_LIMIT:
+            labels.clear()
+        (w, h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+        image = np.zeros((h + baseline + thickness * 2, w + thickness * 2, 3), np.uint8)
+        mask = np.zeros(image.shape[:2], np.uint8)
+        origin = (thickness, h + thickness)
+        cv2.putText(image, text, origin, cv2.FONT_HERSHEY_SIMPLEX, font_scale, color, thickness)
+        cv2.putText(mask, text, origin, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 255, thickness)
+        glyph = (image, mask.astype(bool), h + thickness)
+        labels[key] = glyph
+    return glyph
+
+
+def paste_label(frame, glyph, x, y):
+    """Кладёт готовую надпись так, чтобы (x, y) был началом базовой линии, как у cv2.putText."""
+    image, mask, ascent = glyph
+    top, left = y - ascent, x
+    fh, fw = frame.shape[:2]
+    y1, x1 = max(top, 0), max(left, 0)
+    y2, x2 = min(top + image.shape[0], fh), min(left + image.shape[1], fw)
+    if y1 >= y2 or x1 >= x2:
+        return
+    gy, gx = y1 - top, x1 - left
+    region = frame[y1:y2, x1:x2]
+    np.copyto(region, image[gy:gy + y2 - y1, gx:gx + x2 - x1],
+              where=mask[gy:gy + y2 - y1, gx:gx + x2 - x1, None])
+
+
+def render_frame(latest, cache, display_width, show_labels=True):
+    frame = latest["frame"]
+    zones = latest["zones"]
+    h, w = frame.shape[:2]
+    scale = min(1.0, display_width / w) if display_width else 1.0
+    if scale < 1.0:
+        frame = cv2.resize(frame, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+    else:
+        frame = frame.copy()
+
+    overlay = get_zone_overlay(cache, zones, frame.shape, scale)
+    np.copyto(frame, overlay["image"], where=overlay["mask"][..., None])
+
     alerts = []
-    for p in people:
+    for p in latest["people"]:
         zones_inside = analyze_zones(p, zones)
         color = (0, 255, 0)
         if zones_inside:
@@ -133,97 +314,394 @@ def draw_detections(frame, people, zones):
                     color = z["color"]
                     break
 
-        x1, y1, x2, y2 = p["bbox"]
+        x1, y1, x2, y2 = (round(c * scale) for c in p["bbox"])
+        cx, cy = p["center"]
         cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-        cv2.circle(frame, p["center"], 5, color, -1)
-        cv2.putText(frame, f"ID {p['track_id']}", (x1, y1 - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-    return alerts
-
+        cv2.circle(frame, (round(cx * scale), round(cy * scale)), 5, color, -1)
+        if show_labels:
+            paste_label(frame, get_label(cache, f"ID {p['track_id']}", color), x1, y1 - 10)
 
-# ---------- Обработка кадра ----------
-def process_frame(result, model, zones, confidence, tracked_people, csv_file):
-    frame = result.orig_img.copy()
-    people = get_person_detections(result, model, confidence)
-    update_tracked_people(people, tracked_people, csv_file)
-    alerts = draw_detections(frame, people, zones)
-    return frame, alerts
+    cv2.putText(frame, f"FPS: {latest['fps']:.1f}", (30, 100),
+                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+    if alerts:
+        text = f"Человек в: {', '.join(sorted(set(alerts)))}"
+        paste_label(frame, get_label(cache, text, (0, 0, 255), 1, 3), 30, 50)
+    return frame
 
 
-# ---------- Потоки ----------
-def frame_reader(camera_url, frame_queue, stop_event):
-    cap = cv2.VideoCapture(camera_url)
-    if not cap.isOpened():
-        raise RuntimeError("Не удалось подключиться к камере")
+# ---------- Обработка кадра ----------
+def process_frame(result, model, zones, confidence, tracked_people, csv_file, hold_departures=False, letterbox=None,
+                  heatmap=None):
+    people = get_person_detections(result, model, confidence, letterbox)
+    update_tracked_people(people, tracked_people, zones, csv_file, hold_departures, heatmap)
+    return people
 
-    while not stop_event.is_set():
-        ret, frame = cap.read()
-        if not ret:
-            continue
-        if not frame_queue.full():
-            frame_queue.put(frame)
 
-    cap.release()
+# ---------- Предобработка ----------
+INTERPOLATIONS = {
+    "nearest": cv2.INTER_NEAREST,
+    "linear": cv2.INTER_LINEAR,
+    "area": cv2.INTER_AREA,
+    "cubic": cv2.INTER_CUBIC,
+}
+
+
+def letterbox_params(src_h, src_w, imgsz, stride=32):
+    ratio = min(imgsz / src_h, imgsz / src_w)
+    new_w, new_h = round(src_w * ratio), round(src_h * ratio)
+    # Вход прямоугольный и кратный stride: для 16:9 это 640x384, а не 640x640
+    in_w = int(np.ceil(new_w / stride) * stride)
+    in_h = int(np.ceil(new_h / stride) * stride)
+    return {
+        "src_shape": (src_h, src_w),
+        "ratio": ratio,
+        "size": (new_w, new_h),
+        "pad": ((in_w - new_w) // 2, (in_h - new_h) // 2),
+        "input_shape": (in_h, in_w),
+    }
+
+
+def new_preprocessor(imgsz=640, interpolation="area", pool_size=4):
+    return {
+        "imgsz": imgsz,
+        "interpolation": INTERPOLATIONS.get(interpolation, cv2.INTER_AREA),
+        "pool_size": pool_size,
+        "letterbox": None,
+        "pool": None,
+    }
+
+
+def allocate_buffers(preprocessor, src_h, src_w):
+    """Буферы выделяются один раз под размер потока и пересоздаются только
+    если камера сменила разрешение. Старый пул живёт, пока обработчик не
+    вернёт все взятые из него буферы."""
+    lb = letterbox_params(src_h, src_w, preprocessor["imgsz"])
+    in_h, in_w = lb["input_shape"]
+    new_w, new_h = lb["size"]
+    pool = {
+        "buffers": [np.empty((1, 3, in_h, in_w), np.float32) for _ in range(preprocessor["pool_size"])],
+        "free": queue.Queue(),
+    }
+    for i in range(preprocessor["pool_size"]):
+        pool["free"].put(i)
+    preprocessor["letterbox"] = lb
+    preprocessor["pool"] = pool
+    preprocessor["resized"] = np.empty((new_h, new_w, 3), np.uint8)
+    preprocessor["canvas"] = np.full((in_h, in_w, 3), 114, np.uint8)
+
+
+def preprocess_frame(preprocessor, frame):
+    """Letterbox, BGR->RGB, HWC->CHW и перевод в float32 0..1 прямо в
+    свободный буфер пула. Если все буферы заняты, возвращает None."""
+    h, w = frame.shape[:2]
+    lb = preprocessor["letterbox"]
+    if lb is None or lb["src_shape"] != (h, w):
+        allocate_buffers(preprocessor, h, w)
+        lb = preprocessor["letterbox"]
+
+    pool = preprocessor["pool"]
+    try:
+        index = pool["free"].get_nowait()
+    except queue.Empty:
+        return None
+
+    resized, canvas = preprocessor["resized"], preprocessor["canvas"]
+    new_w, new_h = lb["size"]
+    pad_x, pad_y = lb["pad"]
+    cv2.resize(frame, (new_w, new_h), dst=resized, interpolation=preprocessor["interpolation"])
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+
+    buffer = pool["buffers"][index]
+    np.multiply(canvas.transpose(2, 0, 1)[::-1], np.float32(1 / 255), out=buffer[0], dtype=np.float32)
+    return {
+        "tensor": torch.from_numpy(buffer),
+        "pool": pool,
+        "index": index,
+        "letterbox": lb,
+    }
+
+
+def release_buffer(item):
+    item["pool"]["free"].put(item["index"])
+
+
+def to_source_coords(xyxy, letterbox):
+    ratio = letterbox["ratio"]
+    pad_x, pad_y = letterbox["pad"]
+    src_h, src_w = letterbox["src_shape"]
+    x1, y1, x2, y2 = xyxy
+    return (
+        min(max((x1 - pad_x) / ratio, 0), src_w),
+        min(max((y1 - pad_y) / ratio, 0), src_h),
+        min(max((x2 - pad_x) / ratio, 0), src_w),
+        min(max((y2 - pad_y) / ratio, 0), src_h),
+    )
+
+
+# ---------- Захват ----------
+def open_capture(camera_url, timeout_ms):
+    # Таймауты FFmpeg не дают cap.read() висеть вечно на мёртвом RTSP (OpenCV >= 4.6)
+    try:
+        params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout_ms, cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout_ms]
+        return cv2.VideoCapture(camera_url, cv2.CAP_ANY, params)
+    except (AttributeError, cv2.error):
+        return cv2.VideoCapture(camera_url)
+
+
+def backoff_delay(attempt, base=0.5, max_delay=30.0):
+    """Экспоненциальная задержка с джиттером, чтобы несколько плат не
+    переподключались к NVR синхронно."""
+    # Степень ограничена: после ночи без камеры 2 ** attempt иначе переполняет float
+    return min(max_delay, base * 2 ** min(attempt, 16)) * random.uniform(0.5, 1.0)
+
+
+def new_capture_state():
+    return {
+        "generation": 0,
+        "connected": False,
+        "last_frame_time": time.monotonic(),
+        "outage_started": None,
+        "outages": 0,
+        "downtime_total": 0.0,
+        "last_downtime": 0.0,
+        "last_reconnect_ms": None,
+    }
+
+
+def mark_outage(capture_state, reason):
+    if capture_state["outage_started"] is None:
+        # Простой считаем от последнего удачного кадра, а не от момента, когда его заметили
+        capture_state["outage_started"] = capture_state["last_frame_time"]
+        capture_state["outages"] += 1
+        print(f"[OUTAGE] {reason}")
+    capture_state["connected"] = False
+
+
+def mark_frame(capture_state, reconnect_started):
+    now = time.monotonic()
+    if capture_state["outage_started"] is not None:
+        downtime = now - capture_state["outage_started"]
+        capture_state["last_downtime"] = downtime
+        capture_state["downtime_total"] += downtime
+        capture_state["last_reconnect_ms"] = (now - reconnect_started) * 1000
+        capture_state["outage_started"] = None
+        print(f"[RECONNECT] Поток восстановлен: простой {downtime:.1f} с, "
+              f"переподключение {capture_state['last_reconnect_ms']:.0f} мс, "
+              f"обрывов всего {capture_state['outages']}, простой всего {capture_state['downtime_total']:.1f} с")
+    capture_state["connected"] = True
+    capture_state["last_frame_time"] = now
 
 
-def frame_processor(frame_queue, model, zones, confidence, stop_event, csv_file):
-    prev_time = time.time()
-    tracked_people = {}
+# ---------- Потоки ----------
+def frame_reader(camera_url, frame_queue, stop_event, capture_state, generation, preprocessor, timeout_ms=5000):
+    cap = None
+    attempt = 0
+    reconnect_started = time.monotonic()
+
+    # Поток завершается сам, если супервизор посчитал его зависшим и запустил замену
+    while not stop_event.is_set() and capture_state["generation"] == generation:
+        try:
+            if cap is None or not cap.isOpened():
+                print("[CONNECT] Подключение к камере...")
+                cap = open_capture(camera_url, timeout_ms)
+                if not cap.isOpened():
+                    delay = backoff_delay(attempt)
+                    attempt += 1
+                    print(f"[CAMERA ERROR] Не удалось подключиться. Повтор через {delay:.1f} сек.")
+                    stop_event.wait(delay)
+                    continue
+
+            ret, frame = cap.read()
+            if capture_state["generation"] != generation:
+                break
+            if not ret or frame is None:
+                mark_outage(capture_state, "Ошибка чтения кадра, переподключение...")
+                cap.release()
+                cap = None
+                reconnect_started = time.monotonic()
+                stop_event.wait(backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            attempt = 0
+            mark_frame(capture_state, reconnect_started)
+            if frame_queue.full():
+                continue
+            item = preprocess_frame(preprocessor, frame)
+            if item is not None:
+                item["frame"] = frame
+                frame_queue.put(item)
+
+        except Exception as e:
+            print(f"[READER ERROR] {e}")
+            traceback.print_exc()
+            mark_outage(capture_state, "Ошибка захвата, переподключение...")
+            if cap:
+                cap.release()
+            cap = None
+            reconnect_started = time.monotonic()
+            stop_event.wait(backoff_delay(attempt))
+            attempt += 1
+
+    if cap:
+        cap.release()
+
+
+def capture_supervisor(camera_url, frame_queue, stop_event, capture_state, preprocessor, read_timeout=10.0):
+    """Запускает frame_reader и следит, чтобы кадры шли. Если cap.read()
+    завис дольше read_timeout, зависший поток бросается (он daemon и
+    выйдет сам, когда read() вернётся), а вместо него запускается новый."""
+    timeout_ms = int(read_timeout * 1000)
+
+    def start_reader():
+        generation = capture_state["generation"]
+        capture_state["last_frame_time"] = time.monotonic()
+        thread = threading.Thread(target=frame_reader,
+                                  args=(camera_url, frame_queue, stop_event, capture_state, generation,
+                                        preprocessor, timeout_ms),
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    reader = start_reader()
+    while not stop_event.wait(1.0):
+        stalled = time.monotonic() - capture_state["last_frame_time"] > read_timeout
+        if capture_state["connected"] and stalled:
+            mark_outage(capture_state, f"Нет кадров {read_timeout:.0f} с, перезапуск захвата...")
+            capture_state["generation"] += 1
+            reader = start_reader()
+        elif not reader.is_alive():
+            capture_state["generation"] += 1
+            reader = start_reader()
+
+
+def frame_processor(frame_queue, model, settings_state, stop_event, csv_file, display_state, heatmap,
+                    capture_state, tracked_people, reconnect_grace=2.0):
+    # До первого кадра времени присутствия нет: ожидание прогрева модели и камеры в карту не идёт
+    prev_time = None
+    grace_until = 0.0
+    seen_downtime = 0.0
 
     while not stop_event.is_set():
         if frame_queue.empty():
             time.sleep(0.01)
             continue
 
-        frame = frame_queue.get()
-        results = model.track(frame, persist=True)
+        item = frame_queue.get()
+        try:
+            results = model.track(item["tensor"], persist=True)
+        finally:
+            release_buffer(item)
         if not results:
             continue
 
-        frame, alert = process_frame(results[0], model, zones, confidence, tracked_people, csv_file)
-
+        # Берём снимок настроек один раз на кадр: watcher может заменить их в любой момент
+        settings = settings_state["settings"]
+        zones = settings["zones"]
         curr_time = time.time()
-        fps = 1 / (curr_time - prev_time)
+        # Обрыв определяем по простою, который насчитал захват, а не по паузе между
+        # кадрами: медленный инференс не должен отключать фиксацию уходов
+        downtime_total = capture_state["downtime_total"]
+        downtime = downtime_total - seen_downtime
+        seen_downtime = downtime_total
+        if downtime > 0:
+            grace_until = curr_time + reconnect_grace
+        people = process_frame(results[0], model, zones, settings["confidence"], tracked_people, csv_file,
+                               hold_departures=curr_time < grace_until, letterbox=item["letterbox"],
+                               heatmap=heatmap)
+
+        fps = 0.0
+        if prev_time is not None:
+            # Время обрыва в тепловую карту не пишем: людей в это время никто не видел
+            dt = max(0.0, curr_time - prev_time - downtime)
+            update_heatmap(heatmap, people, tracked_people, item["letterbox"]["src_shape"], dt)
+            fps = 1 / (curr_time - prev_time)
         prev_time = curr_time
-        cv2.putText(frame, f"FPS: {fps:.1f}", (30, 100),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
 
-        draw_zones(frame, zones)
+        # Отрисовкой занимается frame_renderer в своём темпе, здесь только публикуем последний кадр
+        display_state["latest"] = {"frame": item["frame"], "people": people, "zones": zones, "fps": fps}
 
-        if alert:
-            cv2.putText(frame, f"Человек в: {', '.join(set(alert))}",
-                        (30, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 3)
 
-        cv2.imshow("Fish Pool Monitor", frame)
+def frame_renderer(display_state, stop_event, display_width=960, display_fps=10, show_labels=True):
+    cache = {}
+    period = 1 / display_fps if display_fps else 0
+    shown = None
+
+    while not stop_event.is_set():
+        latest = display_state.get("latest")
+        if latest is None or latest is shown:
+            time.sleep(0.01)
+            continue
+        shown = latest
+        started = time.time()
+
+        cv2.imshow("Fish Pool Monitor", render_frame(latest, cache, display_width, show_labels))
         if cv2.waitKey(1) & 0xFF == ord('q'):
             stop_event.set()
             break
 
+        time.sleep(max(0.0, period - (time.time() - started)))
+
     cv2.destroyAllWindows()
 
 
 # ---------- Основной запуск ----------
-def main():
-    config = load_config()
-    global zones
-    zones = prepare_zones(config.get("zones", []))
-    confidence = config.get("confidence", 0.5)
+def main(config_path="config.yaml"):
+    config = load_config(config_path)
     camera_url = config.get("camera_url")
-
-    model = YOLO(config.get("yolo_model", "yolo_model/yolo11s.pt"))
+    model_path = config.get("yolo_model", "yolo_model/yolo11s.pt")
+    # camera_url и yolo_model храним как есть в файле, чтобы watcher сравнивал их с тем же сырым значением
+    settings_state = {
+        "settings": build_settings(config),
+        "camera_url": config.get("camera_url"),
+        "yolo_model": config.get("yolo_model"),
+    }
+
+    model = YOLO(model_path)
     csv_file = init_csv()
 
     frame_queue = queue.Queue(maxsize=5)
     stop_event = threading.Event()
-
-    reader_thread = threading.Thread(target=frame_reader, args=(camera_url, frame_queue, stop_event))
-    processor_thread = threading.Thread(target=frame_processor, args=(frame_queue, model, zones, confidence, stop_event, csv_file))
+    display_state = {"latest": None}
+    capture_state = new_capture_state()
+    tracked_people = {}
+    heatmap = new_heatmap(config.get("heatmap_dir", "heatmaps"), config.get("heatmap_cell", 16))
+    preprocessor = new_preprocessor(config.get("imgsz", 640),
+                                    config.get("interpolation", "area"),
+                                    config.get("preprocess_buffers", 4))
+
+    reader_thread = threading.Thread(target=capture_supervisor,
+                                     args=(camera_url, frame_queue, stop_event, capture_state, preprocessor,
+                                           config.get("read_timeout", 10.0)))
+    processor_thread = threading.Thread(target=frame_processor,
+                                        args=(frame_queue, model, settings_state, stop_event, csv_file, display_state, heatmap,
+                                              capture_state, tracked_people, config.get("reconnect_grace", 2.0)))
+    renderer_thread = threading.Thread(target=frame_renderer,
+                                       args=(display_state, stop_event,
+                                             config.get("display_width", 960),
+                                             config.get("display_fps", 10),
+                                             config.get("show_labels", True)))
+    watcher_thread = threading.Thread(target=config_watcher,
+                                      args=(config_path, settings_state, stop_event,
+                                            config.get("config_reload_interval", 2.0)),
+                                      daemon=True)
+    heatmap_thread = threading.Thread(target=heatmap_writer,
+                                      args=(heatmap, stop_event, config.get("heatmap_save_interval", 300)),
+                                      daemon=True)
 
     reader_thread.start()
     processor_thread.start()
+    renderer_thread.start()
+    watcher_thread.start()
+    heatmap_thread.start()
 
     reader_thread.join()
     processor_thread.join()
+    renderer_thread.join()
+    # Траектории тех, кто ещё в бассейне, тоже сохраняем, иначе при остановке они пропадут
+    for pid, info in tracked_people.items():
+        add_trajectory(heatmap, pid, get_trail(info))
+    save_heatmap(heatmap, keep_current=False)
 
 
 if __name__ == "__main__":
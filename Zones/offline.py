@@ -0,0 +1,276 @@
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import cv2
+from ultralytics import YOLO
+
+from main import load_config, build_settings, get_person_detections, analyze_zones
+
+
+# ---------- Разбиение на чанки ----------
+def probe_video(path):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Не удалось открыть видео {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return fps, frame_count
+
+
+def plan_chunks(path, fps, frame_count, chunk_sec, overlap_sec):
+    """Режет файл на куски по chunk_sec. Каждый кусок, кроме первого,
+    начинается на overlap_sec раньше своей границы: эти кадры нужны
+    трекеру для разогрева и для склейки треков с предыдущим куском."""
+    chunk_frames = max(1, int(chunk_sec * fps))
+    overlap_frames = int(overlap_sec * fps)
+    chunks = []
+    for start in range(0, max(frame_count, 1), chunk_frames):
+        end = min(start + chunk_frames, frame_count)
+        chunks.append({
+            "path": path,
+            "index": len(chunks),
+            "warmup_start": max(0, start - overlap_frames),
+            "start": start,
+            "end": end,
+            # Хвост куска совпадает с разогревом следующего: по нему и склеиваем треки
+            "tail_start": max(start, end - overlap_frames),
+            "is_last": end >= frame_count,
+        })
+    return chunks
+
+
+# ---------- Обработка чанка (в отдельном процессе) ----------
+def _worker_init():
+    # Процессов столько же, сколько ядер, поэтому внутри каждого torch однопоточный
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+
+def process_chunk(chunk, model_path, settings):
+    # Модель грузим на каждый чанк заново, чтобы состояние трекера не перетекало между чанками
+    model = YOLO(model_path)
+    zones = settings["zones"]
+    confidence = settings["confidence"]
+
+    cap = cv2.VideoCapture(chunk["path"])
+    cap.set(cv2.CAP_PROP_POS_FRAMES, chunk["warmup_start"])
+    # Перемотка по кадрам точна не для всех кодеков, поэтому берём позицию, где реально оказались
+    frame_idx = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if frame_idx != chunk["warmup_start"]:
+        print(f"[OFFLINE] {chunk['path']}: перемотка на кадр {chunk['warmup_start']} попала на {frame_idx}")
+
+    tracks = {}
+    # Рамки по кадрам в зоне перекрытия: разогрев в начале и хвост в конце куска
+    head_boxes = {}
+    tail_boxes = {}
+    last_frame = chunk["start"]
+
+    # Последний кусок дочитываем до конца файла: FRAME_COUNT бывает неточным
+    while chunk["is_last"] or frame_idx < chunk["end"]:
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+        results = model.track(frame, persist=True, verbose=False)
+        people = get_person_detections(results[0], model, confidence) if results else []
+
+        if frame_idx < chunk["start"]:
+            head_boxes[frame_idx] = {p["track_id"]: p["bbox"] for p in people}
+        else:
+            for p in people:
+                zones_inside = analyze_zones(p, zones)
+                track = tracks.get(p["track_id"])
+                if track is None:
+                    tracks[p["track_id"]] = {
+                        "first_frame": frame_idx,
+                        "last_frame": frame_idx,
+                        "first_zones": zones_inside,
+                        "last_zones": zones_inside,
+                    }
+                else:
+                    track["last_frame"] = frame_idx
+                    track["last_zones"] = zones_inside
+            if frame_idx >= chunk["tail_start"]:
+                tail_boxes[frame_idx] = {p["track_id"]: p["bbox"] for p in people}
+            last_frame = frame_idx
+
+        frame_idx += 1
+
+    cap.release()
+
+    # В разогреве нужны только те, кого видели и в своей части куска
+    head_boxes = {idx: {tid: box for tid, box in boxes.items() if tid in tracks}
+                  for idx, boxes in head_boxes.items()}
+    return {
+        "path": chunk["path"],
+        "index": chunk["index"],
+        "start": chunk["start"],
+        "last_frame": last_frame,
+        "frames": frame_idx - chunk["start"],
+        "tracks": tracks,
+        "head_boxes": head_boxes,
+        "tail_boxes": tail_boxes,
+    }
+
+
+# ---------- Склейка ----------
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match_boundary(prev_chunk, chunk, iou_threshold):
+    """Сопоставляет треки соседних кусков по всему окну перекрытия.
+
+    На каждом общем кадре пары рамок с IoU >= iou_threshold дают паре
+    треков голос. Пара склеивается, если совпала больше чем в половине
+    кадров, где были видны оба трека, так что пропуск или мерцание
+    детекции на отдельных кадрах склейку не ломают."""
+    votes = {}
+    together = {}
+    for idx, boxes in chunk["head_boxes"].items():
+        prev_boxes = prev_chunk["tail_boxes"].get(idx)
+        if not prev_boxes or not boxes:
+            continue
+        for tid, box in boxes.items():
+            for prev_tid, prev_box in prev_boxes.items():
+                pair = (tid, prev_tid)
+                together[pair] = together.get(pair, 0) + 1
+                if iou(box, prev_box) >= iou_threshold:
+                    votes[pair] = votes.get(pair, 0) + 1
+
+    candidates = sorted(((n, pair) for pair, n in votes.items() if n * 2 > together[pair]), reverse=True)
+    matches = {}
+    used = set()
+    for _, (tid, prev_tid) in candidates:
+        if tid in matches or prev_tid in used:
+            continue
+        matches[tid] = prev_tid
+        used.add(prev_tid)
+    return matches
+
+
+def stitch_chunks(chunks, fps, recording_start, next_id, iou_threshold=0.5):
+    """Переводит локальные id трекера каждого чанка в сквозные и
+    возвращает (события, следующий свободный id)."""
+    people = {}
+    prev_global = {}
+    prev_chunk = None
+
+    for chunk in chunks:
+        matches = match_boundary(prev_chunk, chunk, iou_threshold) if prev_chunk else {}
+        current_global = {}
+        for tid, track in chunk["tracks"].items():
+            if tid in matches and matches[tid] in prev_global:
+                gid = prev_global[matches[tid]]
+                people[gid]["last_frame"] = track["last_frame"]
+                people[gid]["last_zones"] = track["last_zones"]
+            else:
+                gid = next_id
+                next_id += 1
+                people[gid] = dict(track)
+            current_global[tid] = gid
+        prev_global = current_global
+        prev_chunk = chunk
+
+    events = []
+    for gid, info in people.items():
+        arrival = recording_start + timedelta(seconds=info["first_frame"] / fps)
+        departure = recording_start + timedelta(seconds=info["last_frame"] / fps)
+        events.append((arrival, gid, "arrival", info["first_zones"], None))
+        events.append((departure, gid, "departure", info["last_zones"],
+                       (departure - arrival).total_seconds()))
+    return events, next_id
+
+
+# ---------- CSV ----------
+def write_events(events, filename):
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    with open(filename, mode="w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "event", "zones", "time", "duration"])
+        for when, pid, event, zones, duration in sorted(events, key=lambda e: (e[0], e[1])):
+            writer.writerow([
+                pid,
+                event,
+                ",".join(zones) if zones else "",
+                when.strftime("%Y-%m-%d %H:%M:%S"),
+                f"{duration:.2f}s" if duration else ""
+            ])
+
+
+# ---------- Основной запуск ----------
+def parse_args():
+    parser = argparse.ArgumentParser(description="Офлайн-обработка записей NVR в лог посещений")
+    parser.add_argument("videos", nargs="+", help="видеофайлы для обработки")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--output", default="csv/people_log_offline.csv")
+    parser.add_argument("--chunk", type=float, default=600, help="длина чанка, сек")
+    parser.add_argument("--overlap", type=float, default=10, help="разогрев трекера перед чанком, сек")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--start", help="время начала записи 'YYYY-MM-DD HH:MM:SS' (только для одного файла)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.start and len(args.videos) > 1:
+        raise SystemExit("--start можно указать только для одного файла")
+
+    config = load_config(args.config)
+    settings = build_settings(config)
+    model_path = config.get("yolo_model", "yolo_model/yolo11s.pt")
+
+    videos = {}
+    all_chunks = []
+    for path in args.videos:
+        fps, frame_count = probe_video(path)
+        if args.start:
+            recording_start = datetime.strptime(args.start, "%Y-%m-%d %H:%M:%S")
+        else:
+            # NVR дописывает файл до конца записи, так что mtime — это её окончание
+            recording_start = datetime.fromtimestamp(os.path.getmtime(path)) - timedelta(seconds=frame_count / fps)
+        videos[path] = {"fps": fps, "recording_start": recording_start}
+        all_chunks.extend(plan_chunks(path, fps, frame_count, args.chunk, args.overlap))
+
+    print(f"[OFFLINE] Файлов: {len(videos)}, чанков: {len(all_chunks)}, процессов: {args.workers}")
+
+    done = {path: [] for path in videos}
+    video_seconds = 0.0
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_worker_init) as pool:
+        futures = [pool.submit(process_chunk, chunk, model_path, settings) for chunk in all_chunks]
+        for n, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            done[result["path"]].append(result)
+            video_seconds += result["frames"] / videos[result["path"]]["fps"]
+            elapsed = time.time() - started
+            speed = video_seconds / elapsed if elapsed > 0 else 0
+            print(f"[PROGRESS] {n}/{len(all_chunks)} чанков, {video_seconds:.0f} сек видео, "
+                  f"скорость {speed:.1f}× реального времени")
+
+    events = []
+    next_id = 1
+    for path, chunks in done.items():
+        chunks.sort(key=lambda c: c["index"])
+        file_events, next_id = stitch_chunks(chunks, videos[path]["fps"],
+                                             videos[path]["recording_start"], next_id)
+        events.extend(file_events)
+
+    write_events(events, args.output)
+    print(f"[OFFLINE] Готово: {next_id - 1} человек, лог сохранён в {args.output}")
+
+
+if __name__ == "__main__":
+    main()